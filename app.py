@@ -1,29 +1,106 @@
+import eventlet
+eventlet.monkey_patch()
+
+import functools
 import os
-import json
 import random
+import threading
+import time
+import re
+import secrets
 import string
 import math
 from datetime import datetime
+import sqlite3
+
+import orjson
 from flask import Flask, render_template, request, session, redirect, url_for, jsonify
+from flask.json.provider import JSONProvider
+from sqlalchemy import bindparam, event, func, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import aliased, load_only, noload
 from flask_socketio import SocketIO, emit, join_room, leave_room
-from models import db, User, Tournament, Match
+from models import db, User, Tournament, TournamentParticipant, Match
+
+
+# Timestamps are naive UTC (datetime.utcnow); tag them as UTC with a Z
+# suffix so orjson emits RFC 3339 strings clients parse unambiguously.
+_ORJSON_OPTS = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z
+
+
+class OrjsonJSON:
+    """json-module shim backed by orjson for python-socketio packets."""
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        # orjson output is already compact; separators etc. are moot
+        return orjson.dumps(obj, option=_ORJSON_OPTS).decode()
+
+    @staticmethod
+    def loads(s, **kwargs):
+        return orjson.loads(s)
+
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider on orjson, so jsonify() benefits too."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=_ORJSON_OPTS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'chess-tournament-secret-key-change-in-prod')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///database.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Explicit pool: enough headroom for bursts of concurrent handlers,
+# pre-ping to weed out connections killed by a DB restart, LIFO checkout
+# for cache locality, and recycling under typical server idle timeouts.
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': 20,
+    'max_overflow': 30,
+    'pool_timeout': 30,
+    'pool_recycle': 1800,
+    'pool_pre_ping': True,
+    'pool_use_lifo': True,
+}
+
+
+@event.listens_for(Engine, 'connect')
+def _set_sqlite_pragmas(dbapi_conn, connection_record):
+    # WAL lets readers run alongside the writer and synchronous=NORMAL
+    # drops one fsync per commit — the dominant cost of the rapid small
+    # commits the socket handlers produce. No-op on other backends.
+    if not isinstance(dbapi_conn, sqlite3.Connection):
+        return
+    cur = dbapi_conn.cursor()
+    cur.execute('PRAGMA journal_mode=WAL')
+    cur.execute('PRAGMA synchronous=NORMAL')
+    cur.execute('PRAGMA temp_store=MEMORY')
+    cur.execute('PRAGMA mmap_size=268435456')
+    cur.close()
+
+# Optional Redis queue for Socket.IO fan-out. When set, emits are
+# published through Redis so multiple workers (or external processes)
+# can broadcast to the same rooms. Room/match state below is still
+# in-process, so keep a single gunicorn worker until that moves too.
+REDIS_URL = os.environ.get('REDIS_URL')
 
 db.init_app(app)
 socketio = SocketIO(
     app,
     cors_allowed_origins="*",
-    async_mode='threading',
+    async_mode='eventlet',
+    message_queue=REDIS_URL,
+    json=OrjsonJSON,
     ping_timeout=60,
     ping_interval=25,
     max_http_buffer_size=1e6,
     logger=False,
-    engineio_logger=False,
-    transports=['websocket', 'polling']  # fallback to polling if websocket blocked
+    engineio_logger=False
 )
 
 # In-memory state for active rooms and matches
@@ -38,20 +115,40 @@ rooms = {}
 #   'status': 'waiting'|'active'|'completed'
 # }
 
+STARTING_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+# Cheap structural check for client-supplied FEN strings; full legality
+# still lives client-side, this just rejects garbage input.
+FEN_RE = re.compile(r'^[rnbqkpRNBQKP1-8/]+\s[wb]\s[KQkq-]+\s\S+\s\d+\s\d+$')
+
+# Guards compound mutations of rooms/active_matches/sid_to_room. Under
+# eventlet a handler can yield at any socket or DB call, so check-then-
+# mutate sequences need explicit protection rather than relying on the
+# atomicity of single dict operations. (The lock is green-thread aware
+# via monkey_patch.)
+state_lock = threading.Lock()
+
+# Reverse index for O(1) disconnect handling: sid -> room_code
+sid_to_room = {}
+
 active_matches = {}
 # active_matches[match_id] = {
 #   'room_code': str,
 #   'white': str, 'black': str,
-#   'white_time': int, 'black_time': int,
+#   'white_time': float, 'black_time': float,  # as of last turn flip
 #   'turn': 'w'|'b',
+#   'turn_started_at': float,  # time.monotonic() of last turn flip
 #   'fen': str,
-#   'timer_task': ...,
 #   'status': 'active'
 # }
 
 
+_ALPHABET = string.ascii_uppercase + string.digits
+_rng = random.SystemRandom()
+
+
 def generate_room_code():
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
+    return ''.join(secrets.choice(_ALPHABET) for _ in range(6))
 
 
 def get_round_name(num_players):
@@ -67,10 +164,9 @@ def get_round_name(num_players):
 
 def generate_bracket(players):
     """Generate bracket pairings from list of players"""
-    random.shuffle(players)
-    pairs = []
-    for i in range(0, len(players) - 1, 2):
-        pairs.append((players[i], players[i+1]))
+    _rng.shuffle(players)
+    it = iter(players)
+    pairs = list(zip(it, it))
     if len(players) % 2 == 1:
         # Bye for last player
         pairs.append((players[-1], 'BYE'))
@@ -78,24 +174,117 @@ def generate_bracket(players):
 
 
 def calculate_elo(winner_rating, loser_rating, k=32):
+    # Zero-sum before rounding: the winner gains what the loser drops.
     expected_winner = 1 / (1 + 10 ** ((loser_rating - winner_rating) / 400))
-    expected_loser = 1 - expected_winner
-    new_winner = round(winner_rating + k * (1 - expected_winner))
-    new_loser = round(loser_rating + k * (0 - expected_loser))
-    return new_winner, new_loser
+    delta = k * (1 - expected_winner)
+    return round(winner_rating + delta), round(loser_rating - delta)
+
+
+def current_clocks(state):
+    """Remaining (white_time, black_time) with the running side's clock
+    charged for the time since the last turn flip."""
+    white_time = state['white_time']
+    black_time = state['black_time']
+    elapsed = time.monotonic() - state['turn_started_at']
+    if state['turn'] == 'w':
+        white_time -= elapsed
+    else:
+        black_time -= elapsed
+    return white_time, black_time
+
+
+def timer_watchdog(match_id):
+    """Per-match clock authority: pushes timer updates once a second and
+    ends the game when the running side's clock hits zero."""
+    while True:
+        state = active_matches.get(match_id)
+        if not state or state['status'] != 'active':
+            return
+
+        white_time, black_time = current_clocks(state)
+        if white_time <= 0 or black_time <= 0:
+            winner = state['black'] if white_time <= 0 else state['white']
+            with app.app_context():
+                handle_match_end(match_id, winner, 'timeout')
+            return
+
+        socketio.emit('timer_update', {
+            'white_time': round(white_time),
+            'black_time': round(black_time)
+        }, room=f'match_{match_id}')
+        socketio.sleep(min(1, white_time if state['turn'] == 'w' else black_time))
+
+
+def get_tournament(room, for_update=False):
+    """Return the room's Tournament row.
+
+    Reads serve from the row cached on the room dict. Handlers that
+    mutate the row pass for_update=True to re-fetch it through the
+    current session instead of merging the cached graph back in —
+    merge cascades into stale related rows (admin user, participants)
+    and would overwrite concurrent atomic updates with old values.
+    """
+    tournament = room.get('tournament')
+    if tournament is None or for_update:
+        tournament = db.session.get(Tournament, room['tournament_id'])
+    room['tournament'] = tournament
+    return tournament
+
+
+# Debounce state for room broadcasts: room_code -> scheduled greenthread.
+# Bursts of triggers (match end -> leaderboard + round advance ->
+# leaderboard again) coalesce into one serialized emit per room.
+EMIT_DEBOUNCE_SECONDS = 0.05
+_pending_leaderboard = {}
+_pending_room_update = {}
+
+
+def _flush_emit(pending, emit_fn, room_code):
+    pending.pop(room_code, None)
+    with app.app_context():
+        emit_fn(room_code)
+
+
+def schedule_leaderboard(room_code):
+    if room_code not in _pending_leaderboard:
+        _pending_leaderboard[room_code] = eventlet.spawn_after(
+            EMIT_DEBOUNCE_SECONDS, _flush_emit, _pending_leaderboard,
+            emit_leaderboard, room_code)
+
+
+def schedule_room_update(room_code):
+    if room_code not in _pending_room_update:
+        _pending_room_update[room_code] = eventlet.spawn_after(
+            EMIT_DEBOUNCE_SECONDS, _flush_emit, _pending_room_update,
+            emit_room_update, room_code)
+
+
+def _user_version(user):
+    # Every stat in to_dict moves together with one of these counters,
+    # so a change bumps the cache key and stale entries age out of the LRU.
+    return (user.total_matches, user.tournaments_played)
+
+
+@functools.lru_cache(maxsize=1024)
+def _user_dict(uid, version):
+    """Serialized user info memoized on (id, version).
+
+    Callers pass rows they already loaded, so the query.get inside is an
+    identity-map hit and only the dict build is saved/cached.
+    """
+    return User.query.get(uid).to_dict()
 
 
 def emit_room_update(room_code):
     room = rooms.get(room_code)
     if not room:
         return
-    tournament = Tournament.query.get(room['tournament_id'])
-    players_info = []
-    for username in room['players']:
-        user = User.query.filter_by(username=username).first()
-        if user:
-            players_info.append(user.to_dict())
-    
+    tournament = get_tournament(room)
+    usernames = list(room['players'])
+    users = {u.username: u for u in User.query.filter(User.username.in_(usernames)).all()}
+    players_info = [_user_dict(users[username].id, _user_version(users[username]))
+                    for username in usernames if username in users]
+
     data = {
         'players': players_info,
         'admin': room['admin'],
@@ -107,18 +296,42 @@ def emit_room_update(room_code):
     socketio.emit('room_update', data, room=room_code)
 
 
+def _user_id_map(usernames):
+    """Resolve usernames to ids with one IN query."""
+    rows = db.session.execute(
+        select(User.username, User.id).where(User.username.in_(usernames)))
+    return dict(rows.all())
+
+
+# Compiled once; read-only broadcast path skips ORM hydration entirely.
+# Column list mirrors Match.to_dict (datetimes are serialized by orjson);
+# player names come from integer-key joins against users.
+_white_u = aliased(User)
+_black_u = aliased(User)
+_leaderboard_matches_stmt = select(
+    Match.id, Match.tournament_id, Match.round_name,
+    _white_u.username.label('white_player'),
+    _black_u.username.label('black_player'),
+    Match.winner, Match.result,
+    Match.time_control, Match.status, Match.created_at, Match.completed_at
+).join(_white_u, Match.white_user_id == _white_u.id
+).join(_black_u, Match.black_user_id == _black_u.id
+).where(Match.tournament_id == bindparam('tid'))
+
+
 def emit_leaderboard(room_code):
     room = rooms.get(room_code)
     if not room:
         return
-    tournament = Tournament.query.get(room['tournament_id'])
+    tournament = get_tournament(room)
     if not tournament:
         return
-    
-    matches = Match.query.filter_by(tournament_id=room['tournament_id']).all()
+
+    rows = db.session.execute(
+        _leaderboard_matches_stmt, {'tid': room['tournament_id']}).mappings()
     leaderboard = {
         'current_round': tournament.current_round,
-        'matches': [m.to_dict() for m in matches],
+        'matches': [dict(row) for row in rows],
         'bracket': room.get('bracket', []),
         'status': tournament.status,
         'winner': tournament.winner_username
@@ -132,26 +345,30 @@ def check_round_complete(room_code):
     if not room:
         return
     
-    tournament = Tournament.query.get(room['tournament_id'])
+    tournament = get_tournament(room, for_update=True)
     if not tournament or tournament.status != 'active':
         return
     
-    current_round_matches = Match.query.filter_by(
+    # Count unfinished matches instead of hydrating every row
+    pending = db.session.query(func.count(Match.id)).filter(
+        Match.tournament_id == room['tournament_id'],
+        Match.round_name == tournament.current_round,
+        Match.status != 'completed'
+    ).scalar()
+    if pending:
+        return
+
+    # Collect winners (only the column we need)
+    winner_rows = Match.query.filter_by(
         tournament_id=room['tournament_id'],
         round_name=tournament.current_round
-    ).all()
-    
-    # Check if all matches in current round are complete
-    all_complete = all(m.status == 'completed' for m in current_round_matches)
-    if not all_complete:
-        return
-    
-    # Collect winners
-    winners = []
-    for m in current_round_matches:
-        if m.winner and m.winner != 'BYE':
-            winners.append(m.winner)
-    
+    ).with_entities(Match.winner).all()
+    winners = [w for (w,) in winner_rows if w and w != 'BYE']
+    # Match.winner is a plain string column; drop any value that doesn't
+    # resolve to a real user before it can poison pairing or the trophy.
+    user_ids = _user_id_map(winners)
+    winners = [w for w in winners if w in user_ids]
+
     if len(winners) == 1:
         # Tournament complete
         tournament.status = 'completed'
@@ -159,31 +376,29 @@ def check_round_complete(room_code):
         tournament.completed_at = datetime.utcnow()
         room['status'] = 'completed'
         
-        winner_user = User.query.filter_by(username=winners[0]).first()
-        if winner_user:
-            winner_user.tournament_wins += 1
-        
-        for username in room['players']:
-            user = User.query.filter_by(username=username).first()
-            if user:
+        usernames = set(room['players']) | {winners[0]}
+        for user in User.query.filter(User.username.in_(usernames)).all():
+            if user.username == winners[0]:
+                user.tournament_wins += 1
+            if user.username in room['players']:
                 user.tournaments_played += 1
-        
+
         db.session.commit()
         
         socketio.emit('tournament_complete', {
             'winner': winners[0],
             'message': f'🏆 {winners[0]} wins the tournament!'
         }, room=room_code)
-        emit_leaderboard(room_code)
+        schedule_leaderboard(room_code)
         return
     
-    # Start next round
+    # Start next round; current_round follows from the appended round row
     round_name = get_round_name(len(winners))
-    tournament.current_round = round_name
-    
+
     pairs = generate_bracket(winners)
     bracket = []
-    
+    new_matches = []
+
     for white, black in pairs:
         if black == 'BYE':
             # Auto-advance
@@ -193,29 +408,29 @@ def check_round_complete(room_code):
                 'match_id': None
             })
             continue
-        
-        match = Match(
+
+        new_matches.append(dict(
             tournament_id=room['tournament_id'],
             round_name=round_name,
-            white_player=white,
-            black_player=black,
+            white_user_id=user_ids[white],
+            black_user_id=user_ids[black],
             time_control=room.get('default_time', 300),
             status='pending'
-        )
-        db.session.add(match)
-        db.session.flush()
-        
+        ))
         bracket.append({
             'white': white, 'black': black,
             'winner': None, 'status': 'pending',
-            'match_id': match.id
+            'match_id': None
         })
-    
-    db.session.commit()
+
+    # Insert all matches in one batch, then fill the assigned ids back in
+    match_ids = iter(Match.bulk_create(db.session, new_matches))
+    for entry in bracket:
+        if entry['black'] != 'BYE':
+            entry['match_id'] = next(match_ids)
+
     room['bracket'] = bracket
-    rounds = tournament.rounds
-    rounds.append({'round': round_name, 'pairs': [(p[0], p[1]) for p in pairs]})
-    tournament.rounds = rounds
+    tournament.add_round(round_name, [(p[0], p[1]) for p in pairs])
     db.session.commit()
     
     socketio.emit('new_round', {
@@ -223,7 +438,7 @@ def check_round_complete(room_code):
         'bracket': bracket,
         'message': f'🎯 {round_name} begins!'
     }, room=room_code)
-    emit_leaderboard(room_code)
+    schedule_leaderboard(room_code)
 
 
 # =================== ROUTES ===================
@@ -296,8 +511,15 @@ def chess_match(match_id):
 
 @app.route('/leaderboard')
 def leaderboard():
-    users = User.query.order_by(User.elo_rating.desc()).limit(50).all()
-    tournaments = Tournament.query.filter_by(status='completed').order_by(Tournament.completed_at.desc()).limit(20).all()
+    users = User.list_leaderboard(db.session)
+    # The template shows id/code/admin/winner/date plus a participant
+    # count, so fetch only those columns and skip the round rows.
+    tournaments = Tournament.query.options(
+        load_only(Tournament.id, Tournament.room_code,
+                  Tournament.admin_user_id, Tournament.winner_username,
+                  Tournament.completed_at),
+        noload(Tournament.round_rows)
+    ).filter_by(status='completed').order_by(Tournament.completed_at.desc()).limit(20).all()
     return render_template('leaderboard.html', users=users, tournaments=tournaments)
 
 
@@ -312,7 +534,7 @@ def create_room():
     
     tournament = Tournament(
         room_code=room_code,
-        admin_username=session['username'],
+        admin_user_id=session['user_id'],
         status='waiting'
     )
     db.session.add(tournament)
@@ -326,7 +548,8 @@ def create_room():
         'active_matches': {},
         'bracket': [],
         'status': 'waiting',
-        'default_time': 300
+        'default_time': 300,
+        'tournament': tournament
     }
     
     return jsonify({'room_code': room_code})
@@ -351,14 +574,49 @@ def join_room_api():
     return jsonify({'room_code': room_code})
 
 
+@functools.lru_cache(maxsize=256)
+def _tournament_dict(tid, updated_at):
+    """Serialized tournament memoized on (id, updated_at).
+
+    updated_at moves on every write to the tournaments row, so repeat
+    polls of an unchanged tournament skip the load of its participant
+    and round rows as well as the dict build.
+    """
+    return db.session.get(Tournament, tid).to_dict()
+
+
 @app.route('/api/tournaments')
 def get_tournaments():
-    tournaments = Tournament.query.filter_by(status='completed').order_by(Tournament.completed_at.desc()).limit(20).all()
-    return jsonify([t.to_dict() for t in tournaments])
+    # Fetch only the cache keys; full rows load just on cache misses.
+    keys = db.session.execute(
+        db.select(Tournament.id, Tournament.updated_at)
+        .where(Tournament.status == 'completed')
+        .order_by(Tournament.completed_at.desc())
+        .limit(20)).all()
+    return jsonify([_tournament_dict(tid, ts) for tid, ts in keys])
 
 
 # =================== SOCKET EVENTS ===================
 
+def require_room(fn):
+    """Resolve the sender and room once, before the handler runs.
+
+    Wrapped handlers receive (data, username, room_code, room) and are
+    never invoked for unauthenticated sockets or unknown rooms, replacing
+    the identical four-line prelude each room-scoped handler repeated.
+    """
+    @functools.wraps(fn)
+    def wrapper(data):
+        username = session.get('username')
+        room_code = (data.get('room_code') or '').upper()
+        room = rooms.get(room_code)
+        if not username or room is None:
+            emit('error', {'message': 'Invalid room or not logged in'})
+            return
+        return fn(data, username, room_code, room)
+    return wrapper
+
+
 @socketio.on('connect')
 def on_connect():
     pass
@@ -369,74 +627,66 @@ def on_disconnect():
     username = session.get('username')
     if not username:
         return
-    
-    # Remove from any rooms
-    for room_code, room in list(rooms.items()):
-        if username in room['players']:
-            del room['players'][username]
-            leave_room(room_code)
-            
-            if room['status'] == 'waiting':
-                # Update tournament participants
-                tournament = Tournament.query.get(room['tournament_id'])
-                if tournament:
-                    parts = tournament.participants
-                    if username in parts:
-                        parts.remove(username)
-                    tournament.participants = parts
-                    db.session.commit()
-            
-            emit_room_update(room_code)
-            socketio.emit('player_left', {'username': username}, room=room_code)
-            break
+
+    with state_lock:
+        room_code = sid_to_room.pop(request.sid, None)
+        room = rooms.get(room_code)
+        if not room or username not in room['players']:
+            return
+        del room['players'][username]
+
+    leave_room(room_code)
+
+    if room['status'] == 'waiting':
+        # Update tournament participants
+        tournament = get_tournament(room, for_update=True)
+        if tournament:
+            row = next((p for p in tournament.participant_rows
+                        if p.username == username), None)
+            if row:
+                tournament.participant_rows.remove(row)
+                db.session.commit()
+
+    schedule_room_update(room_code)
+    socketio.emit('player_left', {'username': username}, room=room_code)
 
 
 @socketio.on('join_room_socket')
-def on_join_room(data):
-    room_code = data.get('room_code', '').upper()
-    username = session.get('username')
-    
-    if not username or room_code not in rooms:
-        emit('error', {'message': 'Invalid room or not logged in'})
-        return
-    
-    room = rooms[room_code]
-    
-    if room['status'] != 'waiting' and username not in room['players']:
-        emit('error', {'message': 'Tournament already in progress'})
+@require_room
+def on_join_room(data, username, room_code, room):
+    with state_lock:
+        if room['status'] != 'waiting' and username not in room['players']:
+            error = 'Tournament already in progress'
+        elif len(room['players']) >= 10 and username not in room['players']:
+            error = 'Room is full'
+        else:
+            error = None
+            room['players'][username] = request.sid
+            sid_to_room[request.sid] = room_code
+
+    if error:
+        emit('error', {'message': error})
         return
-    
-    if len(room['players']) >= 10 and username not in room['players']:
-        emit('error', {'message': 'Room is full'})
-        return
-    
-    room['players'][username] = request.sid
+
     join_room(room_code)
     
     # Update tournament participants
-    tournament = Tournament.query.get(room['tournament_id'])
-    if tournament:
-        parts = tournament.participants
-        if username not in parts:
-            parts.append(username)
-        tournament.participants = parts
+    tournament = get_tournament(room, for_update=True)
+    if tournament and username not in tournament.participants:
+        tournament.participant_rows.append(
+            TournamentParticipant(username=username))
         db.session.commit()
     
     emit('joined_room', {'room_code': room_code, 'username': username, 'is_admin': username == room['admin']})
-    emit_room_update(room_code)
+    schedule_room_update(room_code)
 
 
 @socketio.on('send_match_request')
-def on_match_request(data):
-    room_code = data.get('room_code', '').upper()
+@require_room
+def on_match_request(data, username, room_code, room):
     opponent = data.get('opponent')
     time_control = int(data.get('time_control', 300))
-    username = session.get('username')
-    
-    if not username or room_code not in rooms:
-        return
-    
-    room = rooms[room_code]
+
     if username not in room['players'] or opponent not in room['players']:
         return
     
@@ -456,16 +706,11 @@ def on_match_request(data):
 
 
 @socketio.on('respond_match_request')
-def on_match_response(data):
-    room_code = data.get('room_code', '').upper()
+@require_room
+def on_match_response(data, username, room_code, room):
     requester = data.get('requester')
     accepted = data.get('accepted', False)
-    username = session.get('username')
-    
-    if not username or room_code not in rooms:
-        return
-    
-    room = rooms[room_code]
+
     request_key = (requester, username)
     
     if request_key not in room['match_requests']:
@@ -481,11 +726,12 @@ def on_match_response(data):
         return
     
     # Create match
+    user_ids = _user_id_map([requester, username])
     match = Match(
         tournament_id=room['tournament_id'],
         round_name='Friendly',
-        white_player=requester,
-        black_player=username,
+        white_user_id=user_ids[requester],
+        black_user_id=user_ids[username],
         time_control=time_control,
         status='active'
     )
@@ -499,12 +745,14 @@ def on_match_response(data):
         'white_time': time_control,
         'black_time': time_control,
         'turn': 'w',
-        'fen': 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+        'turn_started_at': time.monotonic(),
+        'fen': STARTING_FEN,
         'status': 'active',
         'match_id': match.id
     }
     active_matches[match.id] = match_state
-    
+    socketio.start_background_task(timer_watchdog, match.id)
+
     # Notify both players
     for player in [requester, username]:
         player_sid = room['players'].get(player)
@@ -520,20 +768,19 @@ def on_match_response(data):
 
 
 @socketio.on('start_tournament')
-def on_start_tournament(data):
-    room_code = data.get('room_code', '').upper()
+@require_room
+def on_start_tournament(data, username, room_code, room):
     time_control = int(data.get('time_control', 300))
-    username = session.get('username')
-    
-    if not username or room_code not in rooms:
-        return
-    
-    room = rooms[room_code]
+
     if username != room['admin']:
         emit('error', {'message': 'Only admin can start tournament'})
         return
     
     players = list(room['players'].keys())
+    # Everyone in the room joined through login, so each should have a
+    # User row; skip any that don't rather than KeyError mid-bracket.
+    user_ids = _user_id_map(players)
+    players = [p for p in players if p in user_ids]
     if len(players) < 2:
         emit('error', {'message': 'Need at least 2 players to start'})
         return
@@ -541,20 +788,24 @@ def on_start_tournament(data):
     if len(players) > 10:
         emit('error', {'message': 'Maximum 10 players allowed'})
         return
+
+    with state_lock:
+        if room['status'] != 'waiting':
+            # Double-click / duplicate start event; bracket already built
+            return
+        room['status'] = 'active'
+        room['default_time'] = time_control
     
-    room['status'] = 'active'
-    room['default_time'] = time_control
-    
-    tournament = Tournament.query.get(room['tournament_id'])
+    tournament = get_tournament(room, for_update=True)
     tournament.status = 'active'
     tournament.participants = players
     
     round_name = get_round_name(len(players))
-    tournament.current_round = round_name
-    
+
     pairs = generate_bracket(players)
     bracket = []
-    
+    new_matches = []
+
     for white, black in pairs:
         if black == 'BYE':
             bracket.append({
@@ -563,37 +814,40 @@ def on_start_tournament(data):
                 'match_id': None
             })
             continue
-        
-        match = Match(
+
+        # Every first-round pairing goes live in this handler, so the
+        # rows are born 'active' — no second UPDATE pass needed.
+        new_matches.append(dict(
             tournament_id=room['tournament_id'],
             round_name=round_name,
-            white_player=white,
-            black_player=black,
+            white_user_id=user_ids[white],
+            black_user_id=user_ids[black],
             time_control=time_control,
-            status='pending'
-        )
-        db.session.add(match)
-        db.session.flush()
-        
+            status='active'
+        ))
         bracket.append({
             'white': white, 'black': black,
             'winner': None, 'status': 'pending',
-            'match_id': match.id
+            'match_id': None
         })
-    
-    rounds = [{'round': round_name, 'pairs': [(p[0], p[1]) for p in pairs]}]
-    tournament.rounds = rounds
-    db.session.commit()
-    
+
+    # Insert all matches in one batch, then fill the assigned ids back in
+    match_ids = iter(Match.bulk_create(db.session, new_matches))
+    for entry in bracket:
+        if entry['black'] != 'BYE':
+            entry['match_id'] = next(match_ids)
+
+    tournament.add_round(round_name, [(p[0], p[1]) for p in pairs])
+
     room['bracket'] = bracket
-    
+
     socketio.emit('tournament_started', {
         'round_name': round_name,
         'bracket': bracket,
         'message': f'🏆 Tournament started! {round_name} begins!'
     }, room=room_code)
     
-    emit_leaderboard(room_code)
+    schedule_leaderboard(room_code)
     
     # Notify matched players
     for entry in bracket:
@@ -611,18 +865,14 @@ def on_start_tournament(data):
             'white_time': time_control,
             'black_time': time_control,
             'turn': 'w',
-            'fen': 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+            'turn_started_at': time.monotonic(),
+            'fen': STARTING_FEN,
             'status': 'active',
             'match_id': mid
         }
         active_matches[mid] = match_state
-        
-        # Update match status
-        m = Match.query.get(mid)
-        if m:
-            m.status = 'active'
-            db.session.commit()
-        
+        socketio.start_background_task(timer_watchdog, mid)
+
         for player, color in [(white, 'white'), (black, 'black')]:
             player_sid = room['players'].get(player)
             if player_sid:
@@ -634,30 +884,41 @@ def on_start_tournament(data):
                     'time_control': time_control
                 }, to=player_sid)
 
+    db.session.commit()
+
 
 @socketio.on('join_match')
 def on_join_match(data):
     match_id = int(data.get('match_id'))
     username = session.get('username')
-    
-    match = Match.query.get(match_id)
-    if not match or username not in [match.white_player, match.black_player]:
-        emit('error', {'message': 'Invalid match'})
-        return
-    
-    join_room(f'match_{match_id}')
-    
+
     state = active_matches.get(match_id)
     if state:
+        # Live match: validate and serve entirely from in-memory state
+        if username not in [state['white'], state['black']]:
+            emit('error', {'message': 'Invalid match'})
+            return
+
+        join_room(f'match_{match_id}')
+        white_time, black_time = current_clocks(state)
         emit('match_state', {
             'fen': state['fen'],
             'turn': state['turn'],
-            'white_time': state['white_time'],
-            'black_time': state['black_time'],
+            'white_time': round(white_time),
+            'black_time': round(black_time),
             'white': state['white'],
             'black': state['black'],
             'status': state['status']
         })
+        return
+
+    # No live state (match finished, or lost on restart) — check the DB row
+    match = Match.query.get(match_id)
+    if not match or username not in [match.white_player, match.black_player]:
+        emit('error', {'message': 'Invalid match'})
+        return
+
+    join_room(f'match_{match_id}')
 
 
 @socketio.on('make_move')
@@ -684,66 +945,66 @@ def on_make_move(data):
     if not move or not move.get('from') or not move.get('to'):
         emit('error', {'message': 'Invalid move format'})
         return
-    
+
+    # Reject structurally invalid FEN from the client
+    if not fen_after or not FEN_RE.match(fen_after):
+        emit('error', {'message': 'Invalid position'})
+        return
+
+    # Charge the mover's clock for their thinking time
+    now = time.monotonic()
+    elapsed = now - state['turn_started_at']
+    side_key = 'white_time' if state['turn'] == 'w' else 'black_time'
+    state[side_key] -= elapsed
+
+    if state[side_key] <= 0:
+        # Flagged before the move landed
+        winner = state['black'] if state['turn'] == 'w' else state['white']
+        handle_match_end(match_id, winner, 'timeout')
+        return
+
     # Update state
     state['fen'] = fen_after
     state['turn'] = 'b' if state['turn'] == 'w' else 'w'
-    
+    state['turn_started_at'] = now
+
     # Emit move to both players in match room
     socketio.emit('move_made', {
         'move': move,
         'fen': fen_after,
         'turn': state['turn'],
-        'white_time': state['white_time'],
-        'black_time': state['black_time'],
+        'white_time': round(state['white_time']),
+        'black_time': round(state['black_time']),
         'by': username
     }, room=f'match_{match_id}')
 
 
-@socketio.on('update_timer')
-def on_update_timer(data):
-    match_id = int(data.get('match_id'))
-    white_time = data.get('white_time')
-    black_time = data.get('black_time')
-    
-    state = active_matches.get(match_id)
-    if not state or state['status'] != 'active':
-        return
-    
-    username = session.get('username')
-    # Only white player sends timer updates (authoritative)
-    if username != state['white']:
-        return
-    
-    state['white_time'] = white_time
-    state['black_time'] = black_time
-    
-    # Check for timeout
-    if white_time <= 0:
-        handle_match_end(match_id, state['black'], 'timeout')
-    elif black_time <= 0:
-        handle_match_end(match_id, state['white'], 'timeout')
-    else:
-        socketio.emit('timer_update', {
-            'white_time': white_time,
-            'black_time': black_time
-        }, room=f'match_{match_id}')
-
-
 @socketio.on('game_over')
 def on_game_over(data):
     match_id = int(data.get('match_id'))
-    result = data.get('result')  # 'checkmate', 'draw', 'stalemate'
+    result = data.get('result')
     winner = data.get('winner')  # username or None for draw
-    
+
+    # Only board-derived outcomes may come from the client; timeout and
+    # resignation are server-generated. Anything else would bounce off
+    # the match_result CHECK at commit time, after state already moved.
+    if result not in ('checkmate', 'stalemate', 'draw'):
+        return
+
     state = active_matches.get(match_id)
     if not state or state['status'] != 'active':
         return
-    
+
+    # The winner must be one of the two players (None for a draw); an
+    # arbitrary string would land in Match.winner and blow up round
+    # advancement when it fails to resolve to a user id.
+    if winner is not None and winner not in [state['white'], state['black']]:
+        return
+
     username = session.get('username')
     if username not in [state['white'], state['black']]:
         return
-    
+
     handle_match_end(match_id, winner, result)
 
 
@@ -764,46 +1025,53 @@ def on_resign(data):
 
 
 def handle_match_end(match_id, winner, result):
-    state = active_matches.get(match_id)
-    if not state or state['status'] != 'active':
-        return
-    
-    state['status'] = 'completed'
+    # Atomic check-and-complete: a timeout and a resignation for the same
+    # match can race, and only the first may apply stats and ELO.
+    with state_lock:
+        state = active_matches.get(match_id)
+        if not state or state['status'] != 'active':
+            return
+        state['status'] = 'completed'
     
     match = Match.query.get(match_id)
     if not match:
+        del active_matches[match_id]
         return
-    
-    match.status = 'completed'
-    match.winner = winner
-    match.result = result
-    match.completed_at = datetime.utcnow()
-    
-    # Update player stats
-    white_user = User.query.filter_by(username=match.white_player).first()
-    black_user = User.query.filter_by(username=match.black_player).first()
-    
-    if white_user and black_user:
-        white_user.total_matches += 1
-        black_user.total_matches += 1
-        
-        if result == 'draw':
-            white_user.total_draws += 1
-            black_user.total_draws += 1
-        elif winner == match.white_player:
-            white_user.total_wins += 1
-            black_user.total_losses += 1
-            new_w, new_b = calculate_elo(white_user.elo_rating, black_user.elo_rating)
-            white_user.elo_rating = new_w
-            black_user.elo_rating = new_b
-        elif winner == match.black_player:
-            black_user.total_wins += 1
-            white_user.total_losses += 1
-            new_b, new_w = calculate_elo(black_user.elo_rating, white_user.elo_rating)
-            black_user.elo_rating = new_b
-            white_user.elo_rating = new_w
-    
-    db.session.commit()
+
+    try:
+        match.status = 'completed'
+        match.winner = winner
+        match.result = result
+        match.completed_at = datetime.utcnow()
+
+        # Update player stats via atomic SQL increments
+        players = [match.white_player, match.black_player]
+        ratings = dict(db.session.execute(
+            select(User.username, User.elo_rating).where(User.username.in_(players))).all())
+
+        if len(ratings) == 2:
+            if winner in players:
+                loser = players[1] if winner == players[0] else players[0]
+                new_w, new_l = calculate_elo(ratings[winner], ratings[loser])
+                User.apply_match_result(db.session, winner, wins=1,
+                                        elo_delta=new_w - ratings[winner])
+                User.apply_match_result(db.session, loser, losses=1,
+                                        elo_delta=new_l - ratings[loser])
+            else:
+                # Draw/stalemate: no rating change, both get the match counted
+                drawn = 1 if result == 'draw' else 0
+                User.apply_match_result(db.session, players[0], draws=drawn)
+                User.apply_match_result(db.session, players[1], draws=drawn)
+
+        db.session.commit()
+    except Exception:
+        # Put the match back in play: leaving the in-memory state
+        # 'completed' while the row stays 'active' would strand the
+        # match (and its round) forever.
+        db.session.rollback()
+        with state_lock:
+            state['status'] = 'active'
+        raise
     
     # Emit game over to match room
     socketio.emit('game_ended', {
@@ -832,7 +1100,7 @@ def handle_match_end(match_id, winner, result):
             'black': match.black_player
         }, room=room_code)
         
-        emit_leaderboard(room_code)
+        schedule_leaderboard(room_code)
         
         # Check if round is complete
         if match.round_name != 'Friendly':
@@ -843,34 +1111,27 @@ def handle_match_end(match_id, winner, result):
 
 
 @socketio.on('admin_remove_player')
-def on_remove_player(data):
-    room_code = data.get('room_code', '').upper()
+@require_room
+def on_remove_player(data, username, room_code, room):
     target = data.get('username')
-    username = session.get('username')
-    
-    if not username or room_code not in rooms:
-        return
-    
-    room = rooms[room_code]
+
     if username != room['admin']:
         emit('error', {'message': 'Only admin can remove players'})
         return
     
-    if target in room['players']:
-        target_sid = room['players'].pop(target)
+    with state_lock:
+        target_sid = room['players'].pop(target, None)
+        if target_sid:
+            sid_to_room.pop(target_sid, None)
+
+    if target_sid:
         socketio.emit('kicked', {'message': 'You were removed by the admin'}, to=target_sid)
-        emit_room_update(room_code)
+        schedule_room_update(room_code)
 
 
 @socketio.on('admin_force_next_round')
-def on_force_next_round(data):
-    room_code = data.get('room_code', '').upper()
-    username = session.get('username')
-    
-    if not username or room_code not in rooms:
-        return
-    
-    room = rooms[room_code]
+@require_room
+def on_force_next_round(data, username, room_code, room):
     if username != room['admin']:
         emit('error', {'message': 'Only admin can force next round'})
         return
@@ -879,15 +1140,11 @@ def on_force_next_round(data):
 
 
 @socketio.on('chat_message')
-def on_chat(data):
-    room_code = data.get('room_code', '').upper()
+@require_room
+def on_chat(data, username, room_code, room):
     message = data.get('message', '').strip()[:200]
-    username = session.get('username')
-    
-    if not username or room_code not in rooms or not message:
-        return
-    
-    if username not in rooms[room_code]['players']:
+
+    if not message or username not in room['players']:
         return
     
     socketio.emit('chat_message', {
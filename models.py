@@ -1,106 +1,346 @@
+import sys
+
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
-import json
+from sqlalchemy.orm import reconstructor
+import orjson
+
+# Keep attribute values readable after commit so cached rows (e.g. the
+# Tournament handle stored on each room dict) survive across socket events.
+db = SQLAlchemy(session_options={'expire_on_commit': False})
+
+
+class InternedEnum(db.TypeDecorator):
+    """Enum whose values are interned on load, so every row holding e.g.
+    'completed' shares one string object instead of a fresh allocation
+    per row from the driver."""
+    impl = db.Enum
+    cache_ok = True
+
+    def process_result_value(self, value, dialect):
+        return sys.intern(value) if value is not None else None
+
+
+class InternedString(db.TypeDecorator):
+    """String drawn from a small fixed vocabulary (round names); interned
+    on load for the same reason as InternedEnum."""
+    impl = db.String
+    cache_ok = True
 
-db = SQLAlchemy()
+    def process_result_value(self, value, dialect):
+        return sys.intern(value) if value is not None else None
+
+
+def _compiled_to_dict(*fields):
+    """Generate a per-class to_dict that reads self.__dict__ directly.
+
+    Column reads skip SQLAlchemy's InstrumentedAttribute descriptor
+    protocol, which dominates plain-dict serialization cost. fields are
+    (key, kind) pairs: 'col' reads the raw loaded value, 'dt' reads a
+    nullable datetime as-is (orjson formats datetimes natively in C),
+    'prop' goes through the normal attribute (for Python-level
+    properties like Tournament.participants).
+    """
+    parts = []
+    for key, kind in fields:
+        if kind == 'dt':
+            parts.append(f"'{key}': d.get('{key}')")
+        elif kind == 'prop':
+            parts.append(f"'{key}': self.{key}")
+        else:
+            parts.append(f"'{key}': d['{key}']")
+    src = ("def to_dict(self):\n"
+           "    d = self.__dict__\n"
+           "    return {" + ", ".join(parts) + "}\n")
+    ns = {}
+    exec(src, ns)
+    return ns['to_dict']
 
 class User(db.Model):
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(50), unique=True, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now(), nullable=False)
     total_matches = db.Column(db.Integer, default=0)
     total_wins = db.Column(db.Integer, default=0)
     total_losses = db.Column(db.Integer, default=0)
     total_draws = db.Column(db.Integer, default=0)
     tournaments_played = db.Column(db.Integer, default=0)
     tournament_wins = db.Column(db.Integer, default=0)
-    elo_rating = db.Column(db.Integer, default=1200)
-
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'username': self.username,
-            'total_matches': self.total_matches,
-            'total_wins': self.total_wins,
-            'total_losses': self.total_losses,
-            'total_draws': self.total_draws,
-            'tournaments_played': self.tournaments_played,
-            'tournament_wins': self.tournament_wins,
-            'elo_rating': self.elo_rating
-        }
+    elo_rating = db.Column(db.Integer, default=1200, index=True)  # leaderboard ORDER BY
+
+    @classmethod
+    def list_leaderboard(cls, session, limit=50):
+        """Top players by rating as plain rows — no ORM instantiation.
+
+        Returns only the columns the leaderboard renders; rows support
+        attribute access, so templates use them like model instances.
+        """
+        return session.execute(
+            db.select(cls.id, cls.username, cls.elo_rating, cls.total_wins,
+                      cls.total_matches, cls.tournament_wins)
+            .order_by(cls.elo_rating.desc())
+            .limit(limit)).all()
+
+    @classmethod
+    def apply_match_result(cls, session, username, wins=0, losses=0, draws=0, elo_delta=0):
+        """Apply one finished match to a player's stats with a single
+        atomic UPDATE — increments run in SQL, so concurrent finishes
+        can't lose updates the way read-modify-write in Python could."""
+        session.execute(db.update(cls).where(cls.username == username).values(
+            total_matches=cls.total_matches + 1,
+            total_wins=cls.total_wins + wins,
+            total_losses=cls.total_losses + losses,
+            total_draws=cls.total_draws + draws,
+            elo_rating=cls.elo_rating + elo_delta,
+        ))
+
 
 
 class Tournament(db.Model):
     __tablename__ = 'tournaments'
     id = db.Column(db.Integer, primary_key=True)
-    room_code = db.Column(db.String(8), unique=True, nullable=False)
-    admin_username = db.Column(db.String(50), nullable=False)
-    status = db.Column(db.String(20), default='waiting')  # waiting, active, completed
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    room_code = db.Column(db.CHAR(6), unique=True, nullable=False)
+    admin_user_id = db.Column(db.Integer, db.ForeignKey('users.id'),
+                              nullable=False, index=True)
+    status = db.Column(InternedEnum('waiting', 'active', 'completed',
+                                    name='tournament_status',
+                                    create_constraint=True),
+                       default='waiting', nullable=False)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now(),
+                           nullable=False, index=True)
+    # Bumped on every UPDATE of this row; serialization caches key on it.
+    # Lifecycle changes (start, round advance, completion) all write this
+    # row, so the key moves whenever the payload would.
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now(),
+                           onupdate=db.func.now(), nullable=False)
     completed_at = db.Column(db.DateTime, nullable=True)
-    participants_json = db.Column(db.Text, default='[]')
     winner_username = db.Column(db.String(50), nullable=True)
-    current_round = db.Column(db.String(30), default='')
-    rounds_json = db.Column(db.Text, default='[]')
+
+    # Covers the completed-tournaments listing (filter by status,
+    # order by completed_at DESC). Codes are always six chars from
+    # generate_room_code; a fixed-width column keeps index nodes small.
+    __table_args__ = (
+        db.Index('ix_tournaments_status_completed', 'status', 'completed_at'),
+        db.CheckConstraint('length(room_code) = 6',
+                           name='ck_tournaments_room_code_len'),
+    )
+
+    # Collection side is lazy='raise': bulk paths must opt in with
+    # selectinload instead of N+1-ing.
+    matches = db.relationship('Match', back_populates='tournament', lazy='raise')
+
+    # Joined-eager so single-row loads resolve the admin name in the
+    # same query; payloads keep exposing the username.
+    admin_user = db.relationship('User', foreign_keys=[admin_user_id],
+                                 lazy='joined')
+
+    @property
+    def admin_username(self):
+        return self.admin_user.username
+
+    # selectin so listing endpoints batch the child loads (one query per
+    # relationship) instead of lazy-loading per tournament
+    participant_rows = db.relationship(
+        'TournamentParticipant', backref='tournament',
+        cascade='all, delete-orphan', lazy='selectin',
+        order_by='TournamentParticipant.username')
+    round_rows = db.relationship(
+        'TournamentRound', backref='tournament',
+        cascade='all, delete-orphan', lazy='selectin',
+        order_by='TournamentRound.round_index')
 
     @property
     def participants(self):
-        return json.loads(self.participants_json)
+        return [p.username for p in self.participant_rows]
 
     @participants.setter
     def participants(self, value):
-        self.participants_json = json.dumps(value)
+        # Sync child rows to the given username list; joins/leaves use
+        # one-row appends/removes on participant_rows directly.
+        current = {p.username: p for p in self.participant_rows}
+        for username in value:
+            if username not in current:
+                self.participant_rows.append(
+                    TournamentParticipant(username=username))
+        for username, row in current.items():
+            if username not in value:
+                self.participant_rows.remove(row)
+
+    @classmethod
+    def for_participant(cls, session, username):
+        """Tournaments a given user has played in, resolved entirely in
+        SQL via the participant rows (index scan on username)."""
+        return session.execute(
+            db.select(cls)
+            .join(TournamentParticipant,
+                  TournamentParticipant.tournament_id == cls.id)
+            .where(TournamentParticipant.username == username)
+            .order_by(cls.created_at.desc())).scalars().all()
 
     @property
     def rounds(self):
-        return json.loads(self.rounds_json)
-
-    @rounds.setter
-    def rounds(self, value):
-        self.rounds_json = json.dumps(value)
-
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'room_code': self.room_code,
-            'admin_username': self.admin_username,
-            'status': self.status,
-            'created_at': self.created_at.isoformat(),
-            'completed_at': self.completed_at.isoformat() if self.completed_at else None,
-            'participants': self.participants,
-            'winner_username': self.winner_username,
-            'current_round': self.current_round,
-            'rounds': self.rounds
-        }
+        return [{'round': r.round_name, 'pairs': r.pairs} for r in self.round_rows]
+
+    @property
+    def current_round(self):
+        """Name of the latest round, derived from the round rows instead
+        of a separately-maintained column that could drift from them."""
+        return self.round_rows[-1].round_name if self.round_rows else ''
+
+    def add_round(self, round_name, pairs):
+        """Append one round — a single INSERT, not a rewrite of history."""
+        row = TournamentRound(round_index=len(self.round_rows),
+                              round_name=round_name)
+        row.pairs = pairs
+        self.round_rows.append(row)
+
+
+
+class TournamentParticipant(db.Model):
+    __tablename__ = 'tournament_participants'
+    tournament_id = db.Column(db.Integer, db.ForeignKey('tournaments.id'), primary_key=True)
+    username = db.Column(db.String(50), primary_key=True)
+
+    # Answers "which tournaments has user X played" with an index scan
+    __table_args__ = (
+        db.Index('ix_tournament_participants_username', 'username'),
+    )
+
+
+class TournamentRound(db.Model):
+    __tablename__ = 'tournament_rounds'
+    tournament_id = db.Column(db.Integer, db.ForeignKey('tournaments.id'), primary_key=True)
+    round_index = db.Column(db.Integer, primary_key=True)
+    round_name = db.Column(db.String(30), nullable=False)
+    pairs_json = db.Column(db.Text, default='[]')
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._pairs_cache = None
+
+    @reconstructor
+    def _init_on_load(self):
+        self._pairs_cache = None
+
+    @property
+    def pairs(self):
+        """Decoded pairing list, parsed at most once per instance.
+
+        Callers get the cached list and must not mutate it; rounds are
+        append-only so pairings never change after creation.
+        """
+        if self._pairs_cache is None:
+            self._pairs_cache = orjson.loads(self.pairs_json)
+        return self._pairs_cache
+
+    @pairs.setter
+    def pairs(self, value):
+        self.pairs_json = orjson.dumps(value).decode()
+        self._pairs_cache = None
 
 
 class Match(db.Model):
     __tablename__ = 'matches'
     id = db.Column(db.Integer, primary_key=True)
     tournament_id = db.Column(db.Integer, db.ForeignKey('tournaments.id'), nullable=False)
-    round_name = db.Column(db.String(30), nullable=False)
-    white_player = db.Column(db.String(50), nullable=False)
-    black_player = db.Column(db.String(50), nullable=False)
+    round_name = db.Column(InternedString(30), nullable=False)
+    white_user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    black_user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     winner = db.Column(db.String(50), nullable=True)
-    result = db.Column(db.String(20), nullable=True)  # checkmate, timeout, draw, resignation
+    result = db.Column(InternedEnum('checkmate', 'stalemate', 'draw', 'timeout',
+                                    'resignation', name='match_result',
+                                    create_constraint=True),
+                       nullable=True)
     time_control = db.Column(db.Integer, default=300)  # seconds
-    status = db.Column(db.String(20), default='pending')  # pending, active, completed
-    pgn = db.Column(db.Text, default='')
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    status = db.Column(InternedEnum('pending', 'active', 'completed',
+                                    name='match_status',
+                                    create_constraint=True),
+                       default='pending', nullable=False)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now(),
+                           nullable=False, index=True)
     completed_at = db.Column(db.DateTime, nullable=True)
 
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'tournament_id': self.tournament_id,
-            'round_name': self.round_name,
-            'white_player': self.white_player,
-            'black_player': self.black_player,
-            'winner': self.winner,
-            'result': self.result,
-            'time_control': self.time_control,
-            'status': self.status,
-            'created_at': self.created_at.isoformat(),
-            'completed_at': self.completed_at.isoformat() if self.completed_at else None,
-        }
+    tournament = db.relationship('Tournament', back_populates='matches')
+
+    # Game text lives off-row in match_pgn so bracket and leaderboard
+    # queries never drag the blob along; it loads only when the pgn
+    # property is actually touched (a deliberate one-row fetch).
+    pgn_row = db.relationship('MatchPGN', uselist=False,
+                              cascade='all, delete-orphan')
+
+    # Joined-eager on integer keys so any single-match load carries both
+    # player names in one query; broadcast paths use the Core statement
+    # and never hydrate Match rows at all.
+    white_user = db.relationship('User', foreign_keys=[white_user_id],
+                                 lazy='joined', innerjoin=True)
+    black_user = db.relationship('User', foreign_keys=[black_user_id],
+                                 lazy='joined', innerjoin=True)
+
+    @property
+    def white_player(self):
+        return self.white_user.username
+
+    @property
+    def black_player(self):
+        return self.black_user.username
+
+    # Round-completion checks filter on (tournament_id, round_name, status);
+    # the plain tournament_id index serves the full-leaderboard fetch.
+    __table_args__ = (
+        db.Index('ix_matches_tour_round_status', 'tournament_id', 'round_name', 'status'),
+        db.Index('ix_matches_tournament', 'tournament_id'),
+        db.Index('ix_matches_status', 'status'),
+        # Narrow partial index over decided matches only, so stat-repair
+        # recounts never fall back to a sequential scan
+        db.Index('ix_matches_winner_completed', 'winner',
+                 sqlite_where=db.text('winner IS NOT NULL'),
+                 postgresql_where=db.text('winner IS NOT NULL')),
+        # "Find my matches" lookups by pairing — 8-byte integer entries
+        db.Index('ix_matches_players', 'white_user_id', 'black_user_id'),
+    )
+
+    @property
+    def pgn(self):
+        return self.pgn_row.pgn if self.pgn_row else ''
+
+    @pgn.setter
+    def pgn(self, value):
+        if self.pgn_row is None:
+            self.pgn_row = MatchPGN()
+        self.pgn_row.pgn = value
+
+    @classmethod
+    def bulk_create(cls, session, rows):
+        """Insert many matches with one executemany statement and return
+        the new ids in input order — no per-object ORM state needed."""
+        if not rows:
+            return []
+        result = session.execute(
+            db.insert(cls).returning(cls.id, sort_by_parameter_order=True),
+            rows)
+        return [row.id for row in result]
+
+class MatchPGN(db.Model):
+    __tablename__ = 'match_pgn'
+    match_id = db.Column(db.Integer, db.ForeignKey('matches.id'), primary_key=True)
+    pgn = db.Column(db.Text, default='')
+
+
+# Serializers are generated once at import time; see _compiled_to_dict.
+User.to_dict = _compiled_to_dict(
+    ('id', 'col'), ('username', 'col'), ('total_matches', 'col'),
+    ('total_wins', 'col'), ('total_losses', 'col'), ('total_draws', 'col'),
+    ('tournaments_played', 'col'), ('tournament_wins', 'col'),
+    ('elo_rating', 'col'))
+
+Tournament.to_dict = _compiled_to_dict(
+    ('id', 'col'), ('room_code', 'col'), ('admin_username', 'prop'),
+    ('status', 'col'), ('created_at', 'dt'), ('completed_at', 'dt'),
+    ('participants', 'prop'), ('winner_username', 'col'),
+    ('current_round', 'prop'), ('rounds', 'prop'))
+
+Match.to_dict = _compiled_to_dict(
+    ('id', 'col'), ('tournament_id', 'col'), ('round_name', 'col'),
+    ('white_player', 'prop'), ('black_player', 'prop'), ('winner', 'col'),
+    ('result', 'col'), ('time_control', 'col'), ('status', 'col'),
+    ('created_at', 'dt'), ('completed_at', 'dt'))